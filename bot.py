@@ -1,10 +1,15 @@
 import os
-import json
 import re
+import sys
+import atexit
 import logging
-import tempfile
+import sqlite3
+import orjson
+from collections import OrderedDict
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.constants import ChatAction
+from telegram.error import TelegramError
+from telegram.request import HTTPXRequest
 from telegram.ext import (
     ApplicationBuilder, CommandHandler, MessageHandler,
     CallbackQueryHandler, ConversationHandler, ContextTypes, filters
@@ -16,9 +21,18 @@ TOKEN = os.getenv("TOKEN")
 if not TOKEN:
     raise ValueError("❌ No TOKEN found! Set the TOKEN environment variable before running the bot.")
 
-DATA_FILE = "user_strategies.json"
+DB_FILE = "user_data.db"
+# JSON stores used before SQLite, imported into it once
+LEGACY_DATA_FILE = "user_strategies.json"
+LEGACY_DATA_DIR = "user_data"
+LOCK_FILE = "bot.lock"
+FLUSH_INTERVAL = 2.0  # seconds between background saves
 STRATEGY_EDIT = range(1)  # Single state
 
+# "30% Savings", "30 for savings", ...
+_PCT_RE = re.compile(r"(\d+)\s*%?\s*(?:for|on|to)?\s*(.+)", re.IGNORECASE)
+_CONNECTIVES = {"for", "on", "to"}
+
 # --- LOGGING ---
 logging.basicConfig(
     format="%(asctime)s - %(levelname)s - %(message)s",
@@ -27,39 +41,224 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # --- DATA STORAGE ---
+def display_name(category):
+    """User's own spelling of a category, with the first letter capitalized."""
+    return category[:1].upper() + category[1:]
+
+def migrate_entry(entry):
+    """Upgrade a stored chat entry to the {"categories": {key: (name, pct)}, "history": [(key, pct)]} layout."""
+    entry.pop("total", None)
+    stored = entry.get("categories") or {}
+    if isinstance(stored, dict):
+        # older layouts stored {name: pct}
+        stored = [v if isinstance(v, list) else (k, v) for k, v in stored.items()]
+    cats = OrderedDict()
+    history = []
+    for cat, pct in stored:
+        key = cat.casefold()
+        name, prev = cats.get(key, (display_name(cat), 0))
+        cats[key] = (name, prev + pct)
+        history.append((key, pct))
+    entry["categories"] = cats
+    entry["history"] = history
+    return entry
+
+_db = None
+
+def get_db():
+    """Open the SQLite store on first use."""
+    global _db
+    if _db is None:
+        # autocommit; flush_dirty() opens its own transaction per batch
+        _db = sqlite3.connect(DB_FILE, isolation_level=None)
+        _db.execute("PRAGMA journal_mode=WAL")
+        _db.execute("PRAGMA synchronous=NORMAL")
+        _db.execute(
+            "CREATE TABLE IF NOT EXISTS strategies("
+            "chat_id INTEGER PRIMARY KEY, categories_json TEXT NOT NULL)"
+        )
+    return _db
+
 def load_user_data():
-    """Load user data from JSON file."""
+    """Load user data from the SQLite store."""
+    db = get_db()
+    # user_version stays 0 until the JSON stores used before SQLite are imported
+    if db.execute("PRAGMA user_version").fetchone()[0] == 0:
+        import_legacy_data(db)
+    rows = db.execute("SELECT chat_id, categories_json FROM strategies").fetchall()
+    return {
+        chat_id: migrate_entry({"categories": orjson.loads(categories_json)})
+        for chat_id, categories_json in rows
+    }
+
+def import_legacy_data(db):
+    """Copy the pre-SQLite JSON data into the store, exactly once."""
+    # the per-chat files were created from user_strategies.json, so they win
+    if os.path.isdir(LEGACY_DATA_DIR):
+        data = load_legacy_dir()
+    else:
+        data = load_legacy_file()
+    db.execute("BEGIN")
+    try:
+        for chat_id, entry in data.items():
+            write_row(db, chat_id, entry)
+        # committed together with the rows, so the import never runs twice
+        db.execute("PRAGMA user_version = 1")
+        db.execute("COMMIT")
+    except Exception:
+        db.execute("ROLLBACK")
+        raise
+    if data:
+        logger.info("Imported %d chats from the old JSON data.", len(data))
+
+def load_legacy_file():
+    """Read the original single-file store, user_strategies.json."""
     try:
-        with open(DATA_FILE, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        # convert keys to int (saved as strings)
-        return {int(k): v for k, v in data.items()}
-    except (FileNotFoundError, json.JSONDecodeError):
+        with open(LEGACY_DATA_FILE, "rb") as f:
+            data = orjson.loads(f.read())
+    except (FileNotFoundError, orjson.JSONDecodeError):
         return {}
+    # convert keys to int (saved as strings)
+    return {int(k): migrate_entry(v) for k, v in data.items()}
+
+def load_legacy_dir():
+    """Read the per-chat JSON files from LEGACY_DATA_DIR."""
+    data = {}
+    for entry in os.scandir(LEGACY_DATA_DIR):
+        stem, ext = os.path.splitext(entry.name)
+        if ext != ".json":
+            continue
+        try:
+            with open(entry.path, "rb") as f:
+                data[int(stem)] = migrate_entry(orjson.loads(f.read()))
+        except (ValueError, OSError) as e:
+            logger.warning("Skipping unreadable data file %s: %s", entry.path, e)
+    return data
+
+def write_row(db, chat_id, entry):
+    """Insert or replace a chat's row."""
+    # store every entry as a [name, pct] pair so undo still works after a restart
+    cats = entry["categories"]
+    categories_json = orjson.dumps([(cats[key][0], pct) for key, pct in entry["history"]]).decode()
+    db.execute(
+        "INSERT OR REPLACE INTO strategies(chat_id, categories_json) VALUES (?, ?)",
+        (chat_id, categories_json)
+    )
+
+def save_user_data(chat_id):
+    """Save one chat's row, or delete it if the chat was reset. Errors propagate to flush_dirty()."""
+    users = _users()
+    if chat_id in users:
+        write_row(get_db(), chat_id, users[chat_id])
+    else:
+        get_db().execute("DELETE FROM strategies WHERE chat_id = ?", (chat_id,))
+
+_dirty_chat_ids: set[int] = set()
+user_data: dict | None = None  # loaded on first access, see _users()
+
+def _users():
+    """Return the in-memory user data, loading it from disk on first use."""
+    global user_data
+    if user_data is None:
+        user_data = load_user_data()
+    return user_data
 
-def save_user_data():
-    """Save user data to JSON file atomically to avoid corruption."""
+_summary_cache: dict[int, str] = {}
+
+def mark_dirty(chat_id):
+    """Schedule a chat's data to be written on the next flush."""
+    _dirty_chat_ids.add(chat_id)
+    # every mutation goes through here, so this keeps the summary cache fresh
+    _summary_cache.pop(chat_id, None)
+
+def flush_dirty():
+    """Write the data of every chat changed since the last flush."""
+    if not _dirty_chat_ids:
+        return
+    dirty = list(_dirty_chat_ids)
+    _dirty_chat_ids.clear()
+    db = None
     try:
-        # Convert keys back to strings for JSON
-        serializable = {str(k): v for k, v in user_data.items()}
-        dirpath = os.path.dirname(os.path.abspath(DATA_FILE)) or "."
-        with tempfile.NamedTemporaryFile("w", dir=dirpath, delete=False, encoding="utf-8") as tf:
-            json.dump(serializable, tf, indent=4, ensure_ascii=False)
-            tempname = tf.name
-        os.replace(tempname, DATA_FILE)
+        db = get_db()
+        db.execute("BEGIN")
+        for chat_id in dirty:
+            save_user_data(chat_id)
+        db.execute("COMMIT")
     except Exception as e:
-        logger.exception("Failed to save user data: %s", e)
-
-user_data = load_user_data()
+        # keep the batch dirty so the next flush retries it
+        _dirty_chat_ids.update(dirty)
+        logger.exception("Failed to save user data, will retry: %s", e)
+        if db is not None and db.in_transaction:
+            db.execute("ROLLBACK")
+
+async def flush_dirty_job(context: ContextTypes.DEFAULT_TYPE):
+    """Job queue callback for the periodic flush."""
+    flush_dirty()
+
+# make sure pending changes are not lost on shutdown
+atexit.register(flush_dirty)
+
+def acquire_instance_lock():
+    """Take an exclusive lock on LOCK_FILE, or exit if another instance holds it."""
+    fd = os.open(LOCK_FILE, os.O_CREAT | os.O_RDWR, 0o644)
+    try:
+        if sys.platform == "win32":
+            import msvcrt
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        logger.error("Another bot instance is already running (%s is locked).", LOCK_FILE)
+        sys.exit(1)
+    # the lock is held for as long as this fd stays open
+    return fd
+
+# --- NETWORK ---
+class OrjsonRequest(HTTPXRequest):
+    """HTTPXRequest that decodes Telegram's responses with orjson."""
+
+    @staticmethod
+    def parse_json_payload(payload: bytes):
+        try:
+            return orjson.loads(payload)
+        except orjson.JSONDecodeError as exc:
+            logger.error('Can not load invalid JSON data: "%s"', payload.decode("utf-8", "replace"))
+            raise TelegramError("Invalid server response") from exc
 
 # --- HELPERS ---
+def parse_entry(text):
+    """Split user input like `30% Savings` into (pct, category), or return None."""
+    # fast path for the canonical "30% Savings" / "30 Savings" forms
+    head, sep, tail = text.partition("%")
+    if not sep:
+        head, sep, tail = text.partition(" ")
+    # like the regex's (.+), the category ends at the first line break
+    head, tail = head.strip(), tail.partition("\n")[0].strip()
+    if sep and head.isdecimal() and tail and tail.split(None, 1)[0].casefold() not in _CONNECTIVES:
+        return int(head), tail
+
+    match = _PCT_RE.search(text)
+    if not match:
+        return None
+    return int(match.group(1)), match.group(2).strip()
+
 def get_summary(chat_id):
-    """Return formatted strategy summary."""
-    if chat_id not in user_data or not user_data[chat_id]["categories"]:
+    """Return formatted strategy summary, cached until the chat's data changes."""
+    summary = _summary_cache.get(chat_id)
+    if summary is None:
+        summary = _summary_cache[chat_id] = render_summary(chat_id)
+    return summary
+
+def render_summary(chat_id):
+    """Build the strategy summary text."""
+    entry = _users().get(chat_id)
+    if not entry or not entry["categories"]:
         return "📭 You have no categories yet."
 
-    lines = [f"🔹 {cat}: {pct}%" for cat, pct in user_data[chat_id]["categories"]]
-    total = user_data[chat_id]["total"]
+    cats = entry["categories"]
+    lines = [f"🔹 {cat}: {pct}%" for cat, pct in cats.values()]
+    total = sum(pct for _, pct in cats.values())
     remaining = 100 - total
 
     return (
@@ -75,28 +274,45 @@ async def send_typing(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if chat:
         await context.bot.send_chat_action(chat.id, ChatAction.TYPING)
 
+def markdown_mode(text):
+    """Parse mode for text: Markdown only if it contains formatting characters."""
+    return 'Markdown' if any(c in text for c in "*_`[") else None
+
+async def reply(update: Update, text, *, keyboard=None):
+    """Answer a callback query by editing its message, or reply to a plain message."""
+    parse_mode = markdown_mode(text)
+    q = update.callback_query
+    if q:
+        await q.answer()
+        await q.edit_message_text(text, parse_mode=parse_mode, reply_markup=keyboard)
+    elif update.message:
+        await update.message.reply_text(text, parse_mode=parse_mode, reply_markup=keyboard)
+
+_ACTION_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("➕ Add Another Category", callback_data="add")],
+    [InlineKeyboardButton("⏪ Undo Last Entry", callback_data="undo")],
+    [InlineKeyboardButton("❌ Cancel & Reset", callback_data="cancel")]
+])
+
+_START_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🚀 Let's Set Up My Strategy", callback_data="start_strategy")]
+])
+
 def get_action_keyboard():
     """Inline keyboard for next actions."""
-    return InlineKeyboardMarkup([
-        [InlineKeyboardButton("➕ Add Another Category", callback_data="add")],
-        [InlineKeyboardButton("⏪ Undo Last Entry", callback_data="undo")],
-        [InlineKeyboardButton("❌ Cancel & Reset", callback_data="cancel")]
-    ])
+    return _ACTION_KEYBOARD
 
 # --- HANDLERS ---
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /start command."""
     await send_typing(update, context)
-    kb = [[InlineKeyboardButton("🚀 Let's Set Up My Strategy", callback_data="start_strategy")]]
-    # update.message is expected for /start, but guard just in case
-    if update.message:
-        await update.message.reply_text(
-            "👋 *Welcome to your Personal Finance Assistant!* 💰\n\n"
-            "We’ll design a percentage-based budget plan together — dividing your money into categories like Needs, Savings, and Fun.\n"
-            "Click below to start building your personal strategy!",
-            parse_mode='Markdown',
-            reply_markup=InlineKeyboardMarkup(kb)
-        )
+    await reply(
+        update,
+        "👋 *Welcome to your Personal Finance Assistant!* 💰\n\n"
+        "We’ll design a percentage-based budget plan together — dividing your money into categories like Needs, Savings, and Fun.\n"
+        "Click below to start building your personal strategy!",
+        keyboard=_START_KEYBOARD
+    )
 
 async def begin_strategy(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Begin a new strategy."""
@@ -105,8 +321,13 @@ async def begin_strategy(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return ConversationHandler.END
 
     chat_id = chat.id
-    user_data[chat_id] = {"categories": [], "total": 0}
-    save_user_data()
+    users = _users()
+    previous = users.get(chat_id)
+    users[chat_id] = {"categories": OrderedDict(), "history": []}
+    # an empty strategy is saved with the first category; only a reset of
+    # saved categories has to reach the store now
+    if previous and previous["categories"]:
+        mark_dirty(chat_id)
 
     text = (
         "💡 Let's start building your custom financial strategy.\n\n"
@@ -114,14 +335,7 @@ async def begin_strategy(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "For example: `50% Needs` means half your income goes to essentials."
     )
 
-    if update.callback_query:
-        q = update.callback_query
-        await q.answer()
-        await q.edit_message_text(text, parse_mode='Markdown')
-    else:
-        if update.message:
-            await update.message.reply_text(text, parse_mode='Markdown')
-
+    await reply(update, text)
     return STRATEGY_EDIT
 
 async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -133,57 +347,58 @@ async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = chat.id
     text = update.message.text.strip()
 
-    match = re.search(r"(\d+)\s*%?\s*(?:for|on|to)?\s*(.+)", text, re.I)
-    if not match:
-        await update.message.reply_text(
+    # every valid entry starts with its percentage, so skip parsing anything else
+    entry = parse_entry(text) if text[:1].isdecimal() else None
+    if not entry:
+        await reply(
+            update,
             "⚠️ I couldn’t understand that.\n\n"
             "Please use this format: `30% Savings`\n"
-            "This means you want that % of your income to go to a category.",
-            parse_mode='Markdown'
+            "This means you want that % of your income to go to a category."
         )
         return STRATEGY_EDIT
 
-    pct, category = int(match.group(1)), match.group(2).strip().capitalize()
+    pct, category = entry
+    # "Fun", "fun " and "FUN" are the same category
+    key, category = category.casefold(), display_name(category)
 
     if not (0 < pct <= 100):
-        await update.message.reply_text(
-            "❌ Percentage must be between 1 and 100.",
-            parse_mode='Markdown'
-        )
+        await reply(update, "❌ Percentage must be between 1 and 100.")
         return STRATEGY_EDIT
 
     # ensure the user's data exists
-    if chat_id not in user_data:
-        user_data[chat_id] = {"categories": [], "total": 0}
+    users = _users()
+    if chat_id not in users:
+        users[chat_id] = {"categories": OrderedDict(), "history": []}
 
-    total = user_data[chat_id]["total"]
+    cats = users[chat_id]["categories"]
+    total = sum(p for _, p in cats.values())
     if total + pct > 100:
-        await update.message.reply_text(
-            f"❌ Only {100 - total}% left to assign.",
-            parse_mode='Markdown'
-        )
+        await reply(update, f"❌ Only {100 - total}% left to assign.")
         return STRATEGY_EDIT
 
-    user_data[chat_id]["categories"].append((category, pct))
-    user_data[chat_id]["total"] += pct
-    save_user_data()
+    # the first spelling of a category is kept for display
+    category, prev = cats.get(key, (category, 0))
+    cats[key] = (category, prev + pct)
+    users[chat_id]["history"].append((key, pct))
+    mark_dirty(chat_id)
 
-    await update.message.reply_text(
-        f"✅ *Added:* {category} – {pct}%\n\n{get_summary(chat_id)}",
-        parse_mode='Markdown'
+    await reply(
+        update,
+        f"✅ *Added:* {category} – {pct}%\n\n{get_summary(chat_id)}"
     )
 
-    if user_data[chat_id]["total"] == 100:
-        await update.message.reply_text(
-            "🎯 *Strategy complete!*\n\nType /status anytime to view your plan.",
-            parse_mode='Markdown'
+    if total + pct == 100:
+        await reply(
+            update,
+            "🎯 *Strategy complete!*\n\nType /status anytime to view your plan."
         )
         return ConversationHandler.END
 
-    await update.message.reply_text(
+    await reply(
+        update,
         "What would you like to do next?",
-        parse_mode='Markdown',
-        reply_markup=get_action_keyboard()
+        keyboard=get_action_keyboard()
     )
     return STRATEGY_EDIT
 
@@ -192,8 +407,7 @@ async def add_category(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     if not q:
         return STRATEGY_EDIT
-    await q.answer()
-    await q.edit_message_text("Enter the next category as `20% Fun`.", parse_mode='Markdown')
+    await reply(update, "Enter the next category as `20% Fun`.")
     return STRATEGY_EDIT
 
 async def undo(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -203,23 +417,22 @@ async def undo(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return STRATEGY_EDIT
     chat_id = chat.id
 
-    if user_data.get(chat_id) and user_data[chat_id]["categories"]:
-        cat, pct = user_data[chat_id]["categories"].pop()
-        user_data[chat_id]["total"] -= pct
-        save_user_data()
+    entry = _users().get(chat_id)
+    if entry and entry["history"]:
+        # undo only the last entry; earlier amounts for the same category stay
+        key, pct = entry["history"].pop()
+        cats = entry["categories"]
+        cat, current = cats[key]
+        if current == pct:
+            cats.pop(key)
+        else:
+            cats[key] = (cat, current - pct)
+        mark_dirty(chat_id)
         msg = f"⏪ Removed: {cat} ({pct}%)\n\n{get_summary(chat_id)}"
     else:
         msg = "⚠️ Nothing to undo."
 
-    if update.callback_query:
-        await update.callback_query.answer()
-        await update.callback_query.edit_message_text(
-            msg, parse_mode='Markdown', reply_markup=get_action_keyboard()
-        )
-    else:
-        if update.message:
-            await update.message.reply_text(msg, parse_mode='Markdown', reply_markup=get_action_keyboard())
-
+    await reply(update, msg, keyboard=get_action_keyboard())
     return STRATEGY_EDIT
 
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -228,8 +441,8 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not chat:
         return ConversationHandler.END
     chat_id = chat.id
-    user_data.pop(chat_id, None)
-    save_user_data()
+    _users().pop(chat_id, None)
+    mark_dirty(chat_id)
 
     text = (
         "🔄 *Your budget strategy has been reset.*\n\n"
@@ -237,13 +450,7 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "Type /strategy to start over."
     )
 
-    if update.callback_query:
-        await update.callback_query.answer()
-        await update.callback_query.edit_message_text(text, parse_mode='Markdown')
-    else:
-        if update.message:
-            await update.message.reply_text(text, parse_mode='Markdown')
-
+    await reply(update, text)
     return ConversationHandler.END
 
 async def status_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -251,14 +458,26 @@ async def status_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat = update.effective_chat
     if not chat:
         return
-    await update.message.reply_text(
-        get_summary(chat.id),
-        parse_mode='Markdown'
-    )
+    await reply(update, get_summary(chat.id))
 
 # --- MAIN ---
 def main():
-    app = ApplicationBuilder().token(TOKEN).build()
+    # two pollers would fight over getUpdates (409 Conflict) and the data files
+    lock_fd = acquire_instance_lock()  # noqa: F841 - keep the lock for the process lifetime
+
+    if sys.platform != "win32":
+        import uvloop
+        uvloop.install()
+
+    app = (
+        ApplicationBuilder()
+        .token(TOKEN)
+        # same pool sizes ApplicationBuilder uses for its default requests
+        .request(OrjsonRequest(connection_pool_size=256))
+        .get_updates_request(OrjsonRequest(connection_pool_size=1))
+        .build()
+    )
+    app.job_queue.run_repeating(flush_dirty_job, interval=FLUSH_INTERVAL)
 
     # Conversation for strategy building
     conv_handler = ConversationHandler(